@@ -3,16 +3,245 @@ title: BookStack Tool
 author: timvdhoorn
 description: Search BookStack and automatically retrieve full page content. The AI gets direct access to complete documentation.
 version: 1.2.1
-requirements: requests
+requirements: requests, selectolax
 """
 
+import asyncio
+import hashlib
 import html
+import json
 import re
+import sqlite3
+import threading
+import time
 import requests
-from typing import Any, Dict, Callable, Optional
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Callable, FrozenSet, List, Optional, Tuple
 from datetime import datetime
 from pydantic import BaseModel, Field
 
+try:
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    # Without these the client still works, just without retries
+    HTTPAdapter = None
+    Retry = None
+
+try:
+    # Optional: orjson parses large page bodies considerably faster
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    # Optional: fall back to the regex based conversion below
+    LexborHTMLParser = None
+
+try:
+    # Optional: second C-backed parser, used when selectolax is missing
+    import lxml.html as lxml_html
+except ImportError:
+    lxml_html = None
+
+
+# ---- Constants ----
+_USER_AGENT = "OpenWebUI-BookStack-Tool/1.2.1"
+
+# Dutch and English stopwords that add little value to the search
+_STOPWORDS: FrozenSet[str] = frozenset({
+    'welke', 'wat', 'is', 'zijn', 'er', 'de', 'het', 'een', 'van', 'in',
+    'voor', 'op', 'aan', 'met', 'te', 'hoe', 'kan', 'moet', 'waar',
+    'which', 'what', 'are', 'the', 'a', 'an', 'of', 'for',
+    'on', 'at', 'to', 'how', 'can', 'should', 'where', 'there'
+})
+
+# Precompiled patterns for the HTML-to-text conversion
+# Matches any tag; group 1 is set for <br> and <p>, which become line breaks
+_RE_HTML_TAG = re.compile(r'<(br|p)\b[^>]*>|<[^>]+>', re.I)
+_RE_BLANKS = re.compile(r'\n\s*\n+')
+
+# Maximum characters of page content sent along with a citation event;
+# the full content is still part of the tool result for the AI
+_CITATION_MAX = 8000
+
+# Page fetches running at once in search(); the default max_pages runs fully
+# parallel, larger requests (search returns up to 10 hits) are throttled
+_MAX_CONCURRENT_FETCHES = 4
+
+# Number of pages kept in the per-client page cache
+_PAGE_CACHE_SIZE = 256
+
+# Page fields used by search() and get_page(); only these are cached
+_PAGE_FIELDS = ("id", "name", "url", "markdown", "html", "updated_at")
+
+# Elements that start a new line when converting HTML to text
+_BLOCK_TAG_NAMES = (
+    "br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote"
+)
+_BLOCK_TAGS = ", ".join(_BLOCK_TAG_NAMES)
+
+
+def _unesc(text: str) -> str:
+    """html.unescape, skipping the call entirely for text without entities"""
+    return html.unescape(text) if '&' in text else text
+
+
+def _tag_replacement(match: re.Match) -> str:
+    return '\n' if match.group(1) else ''
+
+
+def _parsed_text(html_str: str, separator: Optional[str] = None) -> Optional[str]:
+    """Extract the body text with a C-backed HTML parser, or None if none is usable.
+
+    Without a separator block elements start a new line; with one, every
+    tag boundary becomes that separator.
+    """
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(html_str)
+        if tree.body is None:
+            return ""
+        if separator is not None:
+            return tree.body.text(separator=separator)
+        for node in tree.body.css(_BLOCK_TAGS):
+            node.insert_before("\n")
+        return tree.body.text(separator="")
+    if lxml_html is not None:
+        try:
+            doc = lxml_html.fromstring(html_str)
+        except Exception:
+            # lxml raises ParserError for fragments without element content
+            return None
+        # Full documents: skip <head> (e.g. <title>), as lexbor does
+        body = doc.find("body")
+        if body is not None:
+            doc = body
+        if separator is not None:
+            return separator.join(doc.itertext())
+        for el in doc.iter(*_BLOCK_TAG_NAMES):
+            el.text = "\n" + (el.text or "")
+        return doc.text_content()
+    return None
+
+
+def _html_to_text(html_str: str) -> str:
+    """Convert page HTML to readable text, preserving line breaks"""
+    # Fast paths: skip the parser/regex when there are no tags or entities
+    if '<' not in html_str:
+        text = _unesc(html_str)
+    else:
+        text = _parsed_text(html_str)
+        if text is None:
+            # One pass: line breaks for <br>/<p>, everything else stripped
+            text = _RE_HTML_TAG.sub(_tag_replacement, _unesc(html_str))
+    return _RE_BLANKS.sub('\n\n', text).strip()
+
+
+def _html_to_plain_text(html_str: str) -> str:
+    """Convert page HTML to single-line text, every tag acting as a space"""
+    if '<' not in html_str:
+        text = _unesc(html_str)
+    else:
+        text = _parsed_text(html_str, separator=" ")
+        if text is None:
+            text = _RE_HTML_TAG.sub(' ', _unesc(html_str))
+    return " ".join(text.split())
+
+
+# ---- Caching ----
+class _LRUCache:
+    """Small thread-safe LRU cache"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class _PageCache:
+    """Persistent page cache in SQLite, keyed by (page_id, updated_at).
+
+    Entries are scoped to the BookStack URL and token ID, so pages fetched
+    with one token are never served to another. Errors are swallowed: the
+    cache is an optimization and must never break a tool call.
+    """
+
+    def __init__(self, path: str, base_url: str, token_id: str) -> None:
+        self.scope = hashlib.sha256(f"{base_url}\n{token_id}".encode()).hexdigest()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            # WAL lets several Open WebUI workers read while one writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " scope TEXT NOT NULL, page_id INTEGER NOT NULL,"
+                " updated_at TEXT NOT NULL, name TEXT, url TEXT,"
+                " markdown TEXT, html TEXT, fetched_at REAL,"
+                " PRIMARY KEY (scope, page_id))"
+            )
+
+    def get(self, page_id: Any, updated_at: Any) -> Optional[Dict[str, Any]]:
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT name, url, markdown, html FROM pages"
+                    " WHERE scope = ? AND page_id = ? AND updated_at = ?",
+                    (self.scope, page_id, updated_at),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        name, url, markdown, html_body = row
+        return {
+            "id": page_id,
+            "name": name,
+            "url": url,
+            "markdown": markdown,
+            "html": html_body,
+            "updated_at": updated_at,
+        }
+
+    def put(self, meta: Dict[str, Any]) -> None:
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        self.scope,
+                        meta.get("id"),
+                        meta.get("updated_at"),
+                        meta.get("name"),
+                        meta.get("url"),
+                        meta.get("markdown"),
+                        meta.get("html"),
+                        time.time(),
+                    ),
+                )
+        except sqlite3.Error:
+            pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
 
 # ---- Client with Session + retries ----
 class BookStackClientRequestFailedError(ConnectionError):
@@ -24,33 +253,61 @@ class BookStackClientRequestFailedError(ConnectionError):
         )
 
 
+class BookStackResponseTooLargeError(BookStackClientRequestFailedError):
+    """A successful response exceeded MAX_BODY_BYTES and was not decoded"""
+
+
 class BookStackApiClient:
     def __init__(
-        self, base_url: str, token_id: str, token_secret: str, timeout: int = 30
+        self,
+        base_url: str,
+        token_id: str,
+        token_secret: str,
+        timeout: int = 30,
+        max_body_bytes: int = 2_000_000,
+        pool_size: int = 20,
+        disk_cache: Optional[_PageCache] = None,
     ) -> None:
         self.base_url = base_url.rstrip("/")
         self.token_id = token_id
         self.token_secret = token_secret
         self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self.pool_size = pool_size
+        # Page metadata and converted HTML keyed by (page_id, updated_at);
+        # an edit changes the key, so entries never go stale
+        self.page_cache = _LRUCache(_PAGE_CACHE_SIZE)
+        self.text_cache = _LRUCache(_PAGE_CACHE_SIZE)
+        # Optional second tier that survives restarts (PAGE_CACHE_PATH valve)
+        self.disk_cache = disk_cache
         self.session = requests.Session()
-        try:
-            from requests.adapters import HTTPAdapter
-            from urllib3.util.retry import Retry
-
+        self.session.headers.update(
+            {
+                "Authorization": f"Token {self.token_id}:{self.token_secret}",
+                "Accept": "application/json",
+                "User-Agent": _USER_AGENT,
+            }
+        )
+        if HTTPAdapter is not None and Retry is not None:
             retry = Retry(
                 total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
             )
-            self.session.mount("http://", HTTPAdapter(max_retries=retry))
-            self.session.mount("https://", HTTPAdapter(max_retries=retry))
-        except Exception:
-            pass
+            # Size the pool so concurrent page fetches (and concurrent tool
+            # calls sharing this client) each get a kept-alive connection
+            adapter = HTTPAdapter(
+                max_retries=retry,
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                pool_block=False,
+            )
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
 
-    def _headers(self) -> Dict[str, str]:
-        return {
-            "Authorization": f"Token {self.token_id}:{self.token_secret}",
-            "Accept": "application/json",
-            "User-Agent": "OpenWebUI-BookStack-Tool/1.2.1",
-        }
+    def close(self) -> None:
+        """Close the pooled connections (and disk cache) of this client"""
+        self.session.close()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
 
     def _api(self, endpoint: str) -> str:
         return f"{self.base_url}/api/{endpoint.lstrip('/')}"
@@ -58,33 +315,99 @@ class BookStackApiClient:
     def app_url(self, endpoint: str) -> str:
         return f"{self.base_url}/{endpoint.lstrip('/')}"
 
+    def cached_page(self, page_id: Any, updated_at: Any) -> Optional[Dict[str, Any]]:
+        """Return cached page metadata if the page has not changed since"""
+        meta = self.page_cache.get((page_id, updated_at))
+        if meta is None and self.disk_cache is not None and updated_at:
+            meta = self.disk_cache.get(page_id, updated_at)
+            if meta is not None:
+                self.page_cache.put((page_id, updated_at), meta)
+        return meta
+
+    def cache_page(self, meta: Dict[str, Any]) -> None:
+        """Store page metadata, evicting the least recently used pages"""
+        updated_at = meta.get("updated_at")
+        if not updated_at:
+            return
+        # Drop revision, tag and owner details the tool never reads
+        trimmed = {k: meta[k] for k in _PAGE_FIELDS if k in meta}
+        self.page_cache.put((meta.get("id"), updated_at), trimmed)
+        if self.disk_cache is not None:
+            self.disk_cache.put(trimmed)
+
+    def page_text(self, meta: Dict[str, Any]) -> str:
+        """Return the page HTML as text, converting each page revision once"""
+        key = (meta.get("id"), meta.get("updated_at"))
+        text = self.text_cache.get(key) if key[1] else None
+        if text is None:
+            text = _html_to_text(meta.get("html") or "")
+            if key[1]:
+                self.text_cache.put(key, text)
+        return text
+
+    def _read_body(self, r: requests.Response) -> bytes:
+        """Read at most max_body_bytes + 1 bytes of a streamed response"""
+        try:
+            return r.raw.read(self.max_body_bytes + 1, decode_content=True)
+        finally:
+            r.close()
+
+    def _decode_json(self, r: requests.Response, raw: bytes) -> Dict[str, Any]:
+        """Decode a JSON body; non-JSON bodies (e.g. HTML error pages) give {}"""
+        if not raw or "json" not in r.headers.get("Content-Type", ""):
+            return {}
+        try:
+            return _json_loads(raw)
+        except ValueError:
+            # orjson.JSONDecodeError and json.JSONDecodeError are ValueErrors
+            return {}
+
+    @staticmethod
+    def _error_message(r: requests.Response, data: Dict[str, Any]) -> str:
+        return (data.get("error") or {}).get("message") or r.reason
+
     def get(
         self, endpoint: str, params: Dict[str, str] | None = None
     ) -> Dict[str, Any]:
         r = self.session.get(
             self._api(endpoint),
-            headers=self._headers(),
-            params=params or {},
+            params=params,
             timeout=self.timeout,
+            stream=True,
+        )
+        raw = self._read_body(r)
+        too_large = len(raw) > self.max_body_bytes
+        # Fast path: successful responses are decoded exactly once
+        if r.status_code < 300 and not too_large:
+            return self._decode_json(r, raw)
+        if r.status_code < 300:
+            # A cut-off JSON document cannot be parsed, so report it instead
+            raise BookStackResponseTooLargeError(
+                r.status_code,
+                f"Response larger than {self.max_body_bytes} bytes (MAX_BODY_BYTES)",
+            )
+        data = {} if too_large else self._decode_json(r, raw)
+        raise BookStackClientRequestFailedError(
+            r.status_code, self._error_message(r, data)
         )
-        try:
-            data = r.json()
-        except Exception:
-            data = {}
-        if r.status_code >= 300:
-            msg = data.get("error", {}).get("message") or r.reason
-            raise BookStackClientRequestFailedError(r.status_code, msg)
-        return data
 
     def export_markdown(self, page_id: str) -> str:
         r = self.session.get(
-            self._api(f"/pages/{page_id}/export-markdown"),
-            headers=self._headers(),
+            self._api(f"/pages/{page_id}/export/markdown"),
             timeout=self.timeout,
+            stream=True,
         )
+        raw = self._read_body(r)
         if r.status_code >= 300:
-            raise BookStackClientRequestFailedError(r.status_code, r.reason)
-        return r.text
+            raise BookStackClientRequestFailedError(
+                r.status_code, self._error_message(r, self._decode_json(r, raw))
+            )
+        text = raw[: self.max_body_bytes].decode(
+            r.encoding or "utf-8", errors="replace"
+        )
+        if len(raw) > self.max_body_bytes:
+            text += "\n\n[... content truncated]"
+        return text
 
 
 # ---- Tool Class ----
@@ -103,15 +426,31 @@ class Tools:
             default="",
             description="BookStack API Token Secret",
         )
+        FETCH_FULL_CONTENT: bool = Field(
+            default=True,
+            description="Retrieve full page content in search (disable for faster excerpt-only results)",
+        )
+        MAX_BODY_BYTES: int = Field(
+            default=2_000_000,
+            description="Maximum size in bytes of a single API response",
+        )
+        PAGE_CACHE_PATH: str = Field(
+            default="",
+            description="SQLite file for a persistent page cache (empty = in-memory cache only)",
+        )
 
     def __init__(self):
         # Initialize valves with configuration
         self.valves = self.Valves()
         # Disable automatic citations - we handle them manually
         self.citation = False
+        # The client is reused across calls to keep its connection pool warm;
+        # it is rebuilt when the valves it was created from change
+        self._cached_client: Optional[BookStackApiClient] = None
+        self._cached_valve_sig: Optional[tuple] = None
 
     def _client(self) -> BookStackApiClient:
-        """Create a BookStack client with the valves configuration"""
+        """Return a (cached) BookStack client for the valves configuration"""
         # Validate that configuration is set
         if not self.valves.BOOKSTACK_URL:
             raise ValueError(
@@ -124,25 +463,125 @@ class Tools:
                 "Go to Settings → Tools → BookStack Tool and fill in BOOKSTACK_TOKEN_ID and BOOKSTACK_TOKEN_SECRET."
             )
 
-        return BookStackApiClient(
+        valve_sig = (
             self.valves.BOOKSTACK_URL,
             self.valves.BOOKSTACK_TOKEN_ID,
-            self.valves.BOOKSTACK_TOKEN_SECRET
+            self.valves.BOOKSTACK_TOKEN_SECRET,
+            self.valves.MAX_BODY_BYTES,
+            self.valves.PAGE_CACHE_PATH,
         )
+        if self._cached_client is None or self._cached_valve_sig != valve_sig:
+            if self._cached_client is not None:
+                self._cached_client.close()
+            disk_cache = None
+            if self.valves.PAGE_CACHE_PATH:
+                try:
+                    disk_cache = _PageCache(
+                        self.valves.PAGE_CACHE_PATH,
+                        self.valves.BOOKSTACK_URL,
+                        self.valves.BOOKSTACK_TOKEN_ID,
+                    )
+                except sqlite3.Error:
+                    # Unusable path: keep working with the in-memory cache
+                    disk_cache = None
+            self._cached_client = BookStackApiClient(
+                self.valves.BOOKSTACK_URL,
+                self.valves.BOOKSTACK_TOKEN_ID,
+                self.valves.BOOKSTACK_TOKEN_SECRET,
+                max_body_bytes=self.valves.MAX_BODY_BYTES,
+                disk_cache=disk_cache,
+            )
+            self._cached_valve_sig = valve_sig
+        return self._cached_client
+
+    @staticmethod
+    def _load_page(
+        c: BookStackApiClient, page: Dict[str, Any], use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """Return page metadata from the caches or the API (blocking)"""
+        page_id = page.get("id")
+        # Search results carry updated_at, so an unchanged page is served from cache
+        meta = c.cached_page(page_id, page.get("updated_at")) if use_cache else None
+        if meta is None:
+            # Pages are fetched one by one on purpose: the /pages listing endpoint
+            # only supports eq/ne/gt/lt/gte/lte/like filters (no id "in" list) and
+            # never includes the markdown/html bodies, so it cannot replace this.
+            try:
+                meta = c.get(f"/pages/{page_id}")
+            except BookStackResponseTooLargeError:
+                # /pages/{id} carries both markdown and html; the markdown
+                # export alone is read up to the cap and cut off with a marker
+                return {
+                    "id": page_id,
+                    "name": page.get("name") or f"Page {page_id}",
+                    "url": page.get("url") or c.app_url(f"/link/{page_id}"),
+                    "markdown": c.export_markdown(page_id),
+                }
+            c.cache_page(meta)
+        return meta
+
+    async def _fetch_page(
+        self, c: BookStackApiClient, page: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Retrieve page metadata without blocking the event loop"""
+        # Cache lookup and store run in the thread too: with PAGE_CACHE_PATH
+        # set they are SQLite reads and writes of full page bodies
+        return await asyncio.to_thread(self._load_page, c, page)
+
+    async def _fetch_pages(
+        self, c: BookStackApiClient, pages: List[Dict[str, Any]]
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any], Any]]:
+        """Fetch pages concurrently and yield (idx, page, meta or error) in order.
+
+        A page is yielded as soon as it and all pages before it have arrived,
+        so citations can be emitted early while keeping their numbering.
+        """
+        # Limit parallel requests so a large max_pages does not burst the API
+        limit = asyncio.Semaphore(_MAX_CONCURRENT_FETCHES)
+
+        async def fetch(i: int, page: Dict[str, Any]) -> Tuple[int, Any]:
+            try:
+                async with limit:
+                    return i, await self._fetch_page(c, page)
+            except Exception as e:
+                return i, e
+
+        finished: Dict[int, Any] = {}
+        next_idx = 0
+        for fut in asyncio.as_completed([fetch(i, p) for i, p in enumerate(pages)]):
+            i, result = await fut
+            finished[i] = result
+            while next_idx in finished:
+                yield next_idx + 1, pages[next_idx], finished.pop(next_idx)
+                next_idx += 1
+
+    @staticmethod
+    async def _unfetched_pages(
+        pages: List[Dict[str, Any]]
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any], None]]:
+        """Yield pages like _fetch_pages, but without retrieving any content"""
+        for idx, page in enumerate(pages, 1):
+            yield idx, page, None
 
     def _optimize_query(self, query: str) -> str:
         """Optimize the search query for BookStack by removing stopwords"""
-        # Dutch and English stopwords that add little value to the search
-        stopwords = {
-            'welke', 'wat', 'is', 'zijn', 'er', 'de', 'het', 'een', 'van', 'in',
-            'voor', 'op', 'aan', 'met', 'te', 'hoe', 'kan', 'moet', 'waar',
-            'which', 'what', 'is', 'are', 'the', 'a', 'an', 'of', 'in', 'for',
-            'on', 'at', 'to', 'how', 'can', 'should', 'where', 'there'
-        }
+        words = query.split()
+        # A single keyword has nothing to optimize
+        if len(words) < 2:
+            return query
 
-        # Split query into words and filter stopwords
-        words = query.lower().split()
-        important_words = [w for w in words if w not in stopwords and len(w) > 2]
+        # Only casefold candidate words and drop adjacent duplicates;
+        # casefold() also matches stopwords typed with Unicode variants
+        important_words = []
+        previous = None
+        for w in words:
+            if len(w) <= 2:
+                continue
+            folded = w.casefold()
+            if folded in _STOPWORDS or folded == previous:
+                continue
+            important_words.append(w)
+            previous = folded
 
         # If too few words remain, use original query
         if len(important_words) < 1:
@@ -164,31 +603,50 @@ class Tools:
             query: Search term
             max_pages: Maximum number of pages to fully retrieve (default: 4)
         """
-        # Optimize the query for better results
-        optimized_query = self._optimize_query(query)
-
-        if __event_emitter__:
-            search_msg = f"Searching for: {optimized_query}" if optimized_query != query else "Searching BookStack..."
-            await __event_emitter__(
-                {
-                    "type": "status",
-                    "data": {"description": search_msg, "done": False},
-                }
-            )
+        # Progress updates are sent without waiting for the UI so they overlap
+        # with the API calls; the final status is awaited after they completed
+        pending_emits: set = set()
 
-        # Step 1: Search for relevant pages
-        c = self._client()
-        res = c.get("/search", {"query": optimized_query}).get("data", [])[:10]
+        def emit_status(description: str) -> None:
+            if __event_emitter__:
+                task = asyncio.create_task(
+                    __event_emitter__(
+                        {
+                            "type": "status",
+                            "data": {"description": description, "done": False},
+                        }
+                    )
+                )
+                pending_emits.add(task)
+                task.add_done_callback(pending_emits.discard)
 
-        if not res:
+        async def finish_status(description: str) -> None:
             if __event_emitter__:
+                await asyncio.gather(*pending_emits, return_exceptions=True)
                 await __event_emitter__(
                     {
                         "type": "status",
-                        "data": {"description": "No results found", "done": True},
+                        "data": {"description": description, "done": True},
                     }
                 )
 
+        # Optimize the query for better results
+        optimized_query = self._optimize_query(query)
+
+        search_msg = f"Searching for: {optimized_query}" if optimized_query != query else "Searching BookStack..."
+        emit_status(search_msg)
+
+        # Step 1: Search for relevant pages (in a thread, so the status
+        # update above is delivered while the request is in flight)
+        c = self._client()
+        search_res = await asyncio.to_thread(
+            c.get, "/search", {"query": optimized_query}
+        )
+        res = search_res.get("data", [])[:10]
+
+        if not res:
+            await finish_status("No results found")
+
             no_results_msg = f"**No results found** for '{query}'"
             if optimized_query != query:
                 no_results_msg += f"\n\n_Searched for: '{optimized_query}'_"
@@ -196,94 +654,110 @@ class Tools:
 
             return no_results_msg
 
-        # Step 2: Filter only pages (books/chapters contain no direct content)
-        pages = [r for r in res if r.get("type") == "page"][:max_pages]
+        # Step 2: Filter only pages (books/chapters contain no direct content),
+        # skipping pages the search returned more than once
+        pages = []
+        seen_ids = set()
+        for r in res:
+            if r.get("type") != "page" or r.get("id") in seen_ids:
+                continue
+            seen_ids.add(r.get("id"))
+            pages.append(r)
+        pages = pages[:max_pages]
 
         if not pages:
             # No pages found, show only search results
-            output_lines = ["**No pages found, but these results were found:**\n"]
+            output = ["**No pages found, but these results were found:**\n\n"]
             for i, r in enumerate(res, 1):
                 title = r.get("name", "No title")
                 url = r.get("url", "")
                 item_type = r.get("type", "unknown")
                 item_id = r.get("id", "")
-                output_lines.append(f"{i}. **{title}** ({item_type}, ID: {item_id})")
-                output_lines.append(f"   🔗 [Open in BookStack]({url})\n")
+                output.append(f"{i}. **{title}** ({item_type}, ID: {item_id})\n")
+                output.append(f"   🔗 [Open in BookStack]({url})\n\n")
 
-            if __event_emitter__:
-                await __event_emitter__(
-                    {
-                        "type": "status",
-                        "data": {"description": "Only books/chapters found", "done": True},
-                    }
-                )
+            await finish_status("Only books/chapters found")
 
-            return "\n".join(output_lines)
+            return "".join(output)
 
         # Step 3: Retrieve full content from found pages
-        if __event_emitter__:
-            page_titles = ", ".join([p.get("name", "?")[:30] for p in pages[:2]])
-            if len(pages) > 2:
-                page_titles += "..."
-            await __event_emitter__(
-                {
-                    "type": "status",
-                    "data": {
-                        "description": f"Found: {page_titles}",
-                        "done": False,
-                    },
-                }
-            )
+        page_titles = ", ".join([p.get("name", "?")[:30] for p in pages[:2]])
+        if len(pages) > 2:
+            page_titles += "..."
+        if self.valves.FETCH_FULL_CONTENT:
+            emit_status(f"Retrieving {len(pages)} page(s): {page_titles}")
+            fetched = self._fetch_pages(c, pages)
+        else:
+            # Excerpt-only mode: the search response is all we use
+            fetched = self._unfetched_pages(pages)
 
         # Show which query was used if it was optimized
         query_info = f"'{query}'"
         if optimized_query != query:
             query_info = f"'{query}' (searched for: '{optimized_query}')"
 
-        output_lines = [f"**Found {len(pages)} relevant page(s) for {query_info}:**\n"]
+        output = [f"**Found {len(pages)} relevant page(s) for {query_info}:**\n\n"]
 
         # Track if we successfully retrieved at least 1 page
         success_count = 0
         permission_error = False
         citation_idx = 0  # Track citation index for numbered references
 
-        for idx, page in enumerate(pages, 1):
+        # All pages of this search share one access timestamp
+        now_iso = datetime.now().isoformat()
+
+        # Pages are fetched concurrently and rendered in order as they arrive
+        async for idx, page, meta in fetched:
             page_id = page.get("id")
             title = page.get("name", "No title")
             url = page.get("url", "")
-            excerpt = html.unescape(page.get("excerpt") or "")
-            excerpt = re.sub(r"\s+", " ", excerpt).strip()
+            # Collapse whitespace; split() without arguments also drops empties
+            excerpt = " ".join(_unesc(page.get("excerpt") or "").split())
+
+            if meta is None:
+                # Full content retrieval disabled, show the excerpt only
+                output.append(
+                    f"\n---\n## Page {idx}: {title} [{citation_idx}] (ID: {page_id})\n\n"
+                    f"🔗 [Open in BookStack]({url})\n\n"
+                )
+                if excerpt:
+                    output.append(f"\n**Summary:** {excerpt}\n\n")
 
-            try:
-                # Status: Show which page we're retrieving
                 if __event_emitter__:
                     await __event_emitter__(
                         {
-                            "type": "status",
+                            "type": "citation",
                             "data": {
-                                "description": f"Retrieving: {title}...",
-                                "done": False
+                                "document": [excerpt or title],
+                                "metadata": [
+                                    {
+                                        "date_accessed": now_iso,
+                                        "source": title,
+                                        "url": url,
+                                        "type": "bookstack_page_excerpt",
+                                        "page_id": page_id,
+                                        "note": "Full content retrieval disabled (FETCH_FULL_CONTENT)",
+                                    }
+                                ],
+                                "source": {"name": title, "url": url},
                             },
                         }
                     )
+                citation_idx += 1  # Increment citation counter
+                continue
 
-                # Retrieve page metadata via the correct endpoint
-                meta = c.get(f"/pages/{page_id}", {})
+            try:
+                # Re-raise fetch errors so they are reported per page below
+                if isinstance(meta, BaseException):
+                    raise meta
 
                 # Try to get markdown content (if available)
                 content = meta.get("markdown", "")
 
                 # If no markdown, use the HTML content
                 if not content:
-                    content = meta.get("html", "")
-                    if content:
-                        # Convert HTML to readable text (basic)
-                        content = html.unescape(content)
-                        # Strip HTML tags but preserve line breaks
-                        content = re.sub(r'<br\s*/?>', '\n', content)
-                        content = re.sub(r'<p>', '\n', content)
-                        content = re.sub(r'<[^>]+>', '', content)
-                        content = re.sub(r'\n\s*\n+', '\n\n', content).strip()
+                    # Convert HTML to readable text (cached per page revision)
+                    content = c.page_text(meta)
 
                 # Use URL from metadata if available
                 full_url = meta.get("url") or url
@@ -293,9 +767,12 @@ class Tools:
                     raise ValueError("No content available")
 
                 # Add to output with citation marker
-                output_lines.append(f"\n---\n## Page {idx}: {title} [{citation_idx}] (ID: {page_id})\n")
-                output_lines.append(f"🔗 [Open in BookStack]({full_url})\n")
-                output_lines.append(f"\n{content}\n")
+                output.append(
+                    f"\n---\n## Page {idx}: {title} [{citation_idx}] (ID: {page_id})\n\n"
+                    f"🔗 [Open in BookStack]({full_url})\n\n"
+                )
+                # Append the (large) page body as-is instead of copying it
+                output.extend(("\n", content, "\n\n"))
 
                 # Emit citation with full content
                 if __event_emitter__:
@@ -303,10 +780,14 @@ class Tools:
                         {
                             "type": "citation",
                             "data": {
-                                "document": [content],  # Full content for AI
+                                "document": [
+                                    content[:_CITATION_MAX] + "…[truncated]"
+                                    if len(content) > _CITATION_MAX
+                                    else content
+                                ],
                                 "metadata": [
                                     {
-                                        "date_accessed": datetime.now().isoformat(),
+                                        "date_accessed": now_iso,
                                         "source": title,
                                         "url": full_url,
                                         "type": "bookstack_page",
@@ -328,12 +809,14 @@ class Tools:
                 if e.status_code == 403:
                     permission_error = True
                     # Fallback to excerpt if we don't have permission
-                    output_lines.append(f"\n---\n## Page {idx}: {title} [{citation_idx}] (ID: {page_id})\n")
-                    output_lines.append(f"🔗 [Open in BookStack]({url})\n")
-                    output_lines.append(f"\n⚠️ **No access to full page** (403 Forbidden)\n")
-                    output_lines.append(f"Debug: {error_details}\n")
+                    output.append(
+                        f"\n---\n## Page {idx}: {title} [{citation_idx}] (ID: {page_id})\n\n"
+                        f"🔗 [Open in BookStack]({url})\n\n"
+                        "\n⚠️ **No access to full page** (403 Forbidden)\n\n"
+                        f"Debug: {error_details}\n\n"
+                    )
                     if excerpt:
-                        output_lines.append(f"\n**Summary:** {excerpt}\n")
+                        output.append(f"\n**Summary:** {excerpt}\n\n")
 
                     # Emit citation with excerpt
                     if __event_emitter__:
@@ -344,7 +827,7 @@ class Tools:
                                     "document": [excerpt or title],
                                     "metadata": [
                                         {
-                                            "date_accessed": datetime.now().isoformat(),
+                                            "date_accessed": now_iso,
                                             "source": title,
                                             "url": url,
                                             "type": "bookstack_page_excerpt",
@@ -358,55 +841,57 @@ class Tools:
                         )
                     citation_idx += 1  # Increment citation counter
                 elif e.status_code == 404:
-                    output_lines.append(f"\n---\n## Page {idx}: {title} (ID: {page_id})\n")
-                    output_lines.append(f"🔗 [Open in BookStack]({url})\n")
-                    output_lines.append(f"\n⚠️ **Page not found** (404 Not Found)\n")
-                    output_lines.append(f"Debug: {error_details}\n")
-                    output_lines.append(f"Possible issue: Page ID from search does not match API\n")
+                    output.append(
+                        f"\n---\n## Page {idx}: {title} (ID: {page_id})\n\n"
+                        f"🔗 [Open in BookStack]({url})\n\n"
+                        "\n⚠️ **Page not found** (404 Not Found)\n\n"
+                        f"Debug: {error_details}\n\n"
+                        "Possible issue: Page ID from search does not match API\n\n"
+                    )
                     if excerpt:
-                        output_lines.append(f"\n**Summary:** {excerpt}\n")
+                        output.append(f"\n**Summary:** {excerpt}\n\n")
                 else:
-                    output_lines.append(f"\n---\n## Page {idx}: {title} (ID: {page_id})\n")
-                    output_lines.append(f"🔗 [Open in BookStack]({url})\n")
-                    output_lines.append(f"\n⚠️ **API Error**\n")
-                    output_lines.append(f"Debug: {error_details}\n")
+                    output.append(
+                        f"\n---\n## Page {idx}: {title} (ID: {page_id})\n\n"
+                        f"🔗 [Open in BookStack]({url})\n\n"
+                        "\n⚠️ **API Error**\n\n"
+                        f"Debug: {error_details}\n\n"
+                    )
                     if excerpt:
-                        output_lines.append(f"\n**Summary:** {excerpt}\n")
+                        output.append(f"\n**Summary:** {excerpt}\n\n")
 
             except Exception as e:
                 # Unexpected errors
-                output_lines.append(f"\n---\n## Page {idx}: {title} (ID: {page_id})\n")
-                output_lines.append(f"🔗 [Open in BookStack]({url})\n")
-                output_lines.append(f"\n⚠️ **Unexpected error**: {type(e).__name__}\n")
-                output_lines.append(f"Details: {str(e)}\n")
+                output.append(
+                    f"\n---\n## Page {idx}: {title} (ID: {page_id})\n\n"
+                    f"🔗 [Open in BookStack]({url})\n\n"
+                    f"\n⚠️ **Unexpected error**: {type(e).__name__}\n\n"
+                    f"Details: {str(e)}\n\n"
+                )
                 if excerpt:
-                    output_lines.append(f"\n**Summary:** {excerpt}\n")
+                    output.append(f"\n**Summary:** {excerpt}\n\n")
 
         # Add warning if we had permission errors
         if permission_error:
-            output_lines.append("\n\n---\n")
-            output_lines.append("⚠️ **API Permission Issue Detected**\n\n")
-            output_lines.append("The BookStack API token does not have permission to retrieve full pages.\n")
-            output_lines.append("Only summaries (excerpts) are available.\n\n")
-            output_lines.append("**Solution:**\n")
-            output_lines.append("1. Go to your BookStack profile → API Tokens\n")
-            output_lines.append("2. Check the token permissions\n")
-            output_lines.append("3. Ensure the token has 'View' permissions for Pages\n")
-            output_lines.append("4. Or ask the administrator for a token with more permissions\n")
-
-        if __event_emitter__:
-            if success_count > 0:
-                status_msg = f"✓ {success_count} page(s) successfully retrieved"
-            else:
-                status_msg = "Search completed (only summaries available)"
-            await __event_emitter__(
-                {
-                    "type": "status",
-                    "data": {"description": status_msg, "done": True},
-                }
+            output.append(
+                "\n\n---\n\n"
+                "⚠️ **API Permission Issue Detected**\n\n\n"
+                "The BookStack API token does not have permission to retrieve full pages.\n\n"
+                "Only summaries (excerpts) are available.\n\n\n"
+                "**Solution:**\n\n"
+                "1. Go to your BookStack profile → API Tokens\n\n"
+                "2. Check the token permissions\n\n"
+                "3. Ensure the token has 'View' permissions for Pages\n\n"
+                "4. Or ask the administrator for a token with more permissions\n\n"
             )
 
-        return "\n".join(output_lines)
+        if success_count > 0:
+            status_msg = f"✓ {success_count} page(s) successfully retrieved"
+        else:
+            status_msg = "Search completed (only summaries available)"
+        await finish_status(status_msg)
+
+        return "".join(output)
 
     async def get_page(
         self,
@@ -431,7 +916,12 @@ class Tools:
             )
 
         c = self._client()
-        meta = c.get(f"/pages/{page_id}", {})
+        # One request covers every format: /pages/{id} returns name, url,
+        # markdown and html together, while the export endpoints lack the
+        # title/url and would need this call anyway
+        meta = await asyncio.to_thread(
+            self._load_page, c, {"id": page_id}, use_cache=False
+        )
         title = meta.get("name", "Unknown page")
         url = meta.get("url", "")
 
@@ -441,20 +931,13 @@ class Tools:
             content = meta.get("markdown", "")
             if not content:
                 # Fallback to HTML
-                content = meta.get("html", "")
-                if content:
-                    content = html.unescape(content)
-                    content = re.sub(r'<br\s*/?>', '\n', content)
-                    content = re.sub(r'<p>', '\n', content)
-                    content = re.sub(r'<[^>]+>', '', content)
-                    content = re.sub(r'\n\s*\n+', '\n\n', content).strip()
+                content = c.page_text(meta)
+        elif format in ("text", "html") and "html" not in meta:
+            # Oversized page: only the (truncated) markdown export is available
+            content = meta.get("markdown") or ""
         elif format == "text":
             # Text format: use HTML and strip all tags
-            content = meta.get("html", "")
-            if content:
-                content = html.unescape(content)
-                content = re.sub(r'<[^>]+>', ' ', content)
-                content = re.sub(r'\s+', ' ', content).strip()
+            content = _html_to_plain_text(meta.get("html") or "")
         elif format == "html":
             content = meta.get("html") or ""
         else: